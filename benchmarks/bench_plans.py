@@ -0,0 +1,50 @@
+"""Compare shape-specialized message plans with the generic convert_message path.
+
+Usage:
+    python benchmarks/bench_plans.py [turns]
+
+The request has recurring shapes: a system prompt followed by turns of
+(user text, assistant tool call, tool result). convert() used to deep-copy
+the request and then run convert_message on every message. It now runs the
+cached plan for each message's shape, which copies only what it carries over.
+"""
+import os
+import sys
+import timeit
+from copy import deepcopy
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'src'))
+from apiomorphic import translate
+
+def openai_request(turns):
+    messages = [{'role':'system','content':'You are a helpful assistant.'}]
+    for i in range(turns):
+        messages += [
+            {'role':'user','content':[{'type':'text','text':f'question {i}'}]},
+            {'role':'assistant','tool_calls':[{'id':f'call_{i}','type':'function','function':{'name':'lookup','arguments':'{"q": %d}' % i}}]},
+            {'role':'tool','tool_call_id':f'call_{i}','content':f'result {i}'},
+            ]
+    return {'model':'m','max_tokens':100,'messages':messages}
+
+def best(func, number):
+    return min(timeit.repeat(func, number=number, repeat=5)) / number * 1e6
+
+def main(turns=20, number=2000):
+    request = openai_request(turns)
+    cases = [
+        ('openai->anthropic', translate('openai', 'anthropic'), [msg for msg in request['messages'] if msg['role'] != 'system']),
+        ('anthropic->openai', translate('anthropic', 'openai'), translate('openai', 'anthropic').convert(request)['messages']),
+        ]
+    print(f'{1 + 3 * turns} messages per request, microseconds per request')
+    for name, converter, messages in cases:
+        def generic():
+            return [out for msg in deepcopy(messages) for out in converter.convert_message(msg)]
+        def planned():
+            return [out for msg in messages for out in converter.message_plan(msg)(msg)]
+        assert generic() == planned()
+        generic_us = best(generic, number)
+        planned_us = best(planned, number)
+        print(f'{name:18} generic {generic_us:8.1f}  planned {planned_us:8.1f}  speedup {generic_us / planned_us:4.1f}x')
+
+if __name__ == '__main__':
+    main(*[int(arg) for arg in sys.argv[1:2]])
@@ -1 +1,7 @@
 from .core import translate, FromOpenAi, FromAnthropic, FromBase, ToBase, format_tool_schema
+from .shared import SharedArtifactStore
+from .store import ConversationStore
+from .wire import dump_request, load_request, send_request, recv_request
+from .hedge import HedgedDispatcher
+from .logindex import LogIndex
+from .media import FileStore, LocalFileStore, MediaCache
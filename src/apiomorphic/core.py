@@ -1,17 +1,213 @@
 import re
 import json
+import time
+import asyncio
 from copy import deepcopy
-from typing import Dict, List, Union, Optional, Any, Literal, Tuple
+from concurrent.futures import Executor, ThreadPoolExecutor
+from typing import Dict, List, Union, Optional, Any, Literal, Tuple, AsyncIterator
 
 
 class FromBase:
     pass
 
+_executor = None
+
+def _default_executor() -> Executor:
+    global _executor
+    if _executor is None:
+        _executor = ThreadPoolExecutor(max_workers=4, thread_name_prefix='apiomorphic')
+    return _executor
+
+def _payload_size(obj : Any, limit : int) -> int:
+    """Total length of the strings in obj, counting stops once limit is reached."""
+    size = 0
+    stack = [obj]
+    while stack and size < limit:
+        obj = stack.pop()
+        if isinstance(obj, str):
+            size += len(obj)
+        elif isinstance(obj, dict):
+            stack.extend(obj.values())
+        elif isinstance(obj, list):
+            stack.extend(obj)
+    return size
+
 class ToBase:
-    pass
+    #payloads with at least this many characters of strings are converted off the event loop
+    inline_threshold : int = 256 * 2**10
+    #api format of the converted requests, set by each converter
+    target_format : Optional[str] = None
+    #shared by all converters; inline_seconds is time spent blocking the event loop
+    async_stats : Dict[str, Any] = {'inline':0, 'offloaded':0, 'inline_seconds':0.0, 'max_inline_seconds':0.0}
+
+    @classmethod
+    async def _arun(cls, func, payload, executor : Optional[Executor]):
+        if _payload_size(payload, cls.inline_threshold) < cls.inline_threshold:
+            start = time.perf_counter()
+            result = func(payload)
+            elapsed = time.perf_counter() - start
+            cls.async_stats['inline'] += 1
+            cls.async_stats['inline_seconds'] += elapsed
+            cls.async_stats['max_inline_seconds'] = max(cls.async_stats['max_inline_seconds'], elapsed)
+            return result
+        cls.async_stats['offloaded'] += 1
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(executor or _default_executor(), func, payload)
+
+    @classmethod
+    async def aconvert(cls, api_params : Dict[str,Any], executor : Optional[Executor] = None, media = None) -> Dict[str,Any]:
+        """Asyncio version of convert().
+
+        Small requests are converted inline. Requests above inline_threshold are
+        converted in executor (a bounded shared thread pool by default; pass a
+        ProcessPoolExecutor to keep the GIL free too). Cancelling the await
+        abandons the result; a conversion already running in a worker finishes
+        in the background.
+
+        With media, images are replaced after the conversion returns, always in
+        the shared thread pool of this process: uploads may block, and the
+        cache cannot be sent to another process.
+        """
+        new_params = await cls._arun(cls.convert, api_params, executor)
+        if media is None:
+            return new_params
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(_default_executor(), media.replace_images, new_params, cls.target_format)
+
+    @classmethod
+    def _convert_message_copy(cls, msg : Dict[str,Any]) -> List[Dict[str,Any]]:
+        return cls.message_plan(msg)(msg)
+
+    @classmethod
+    async def aiter_messages(cls, api_params : Dict[str,Any], executor : Optional[Executor] = None) -> AsyncIterator[Dict[str,Any]]:
+        """Asynchronously yield the convert_message() output for each message of api_params.
+
+        Each message is converted inline or in executor on its own, following the
+        same threshold as aconvert(), and control returns to the event loop
+        between messages.
+        """
+        for msg in api_params['messages']:
+            for converted in await cls._arun(cls._convert_message_copy, msg, executor):
+                yield converted
+            await asyncio.sleep(0)
+
+    #shape -> specialized conversion function
+    _plans : Dict[Any, Any] = {}
+    #the same plans as nested dicts: role -> list -> entry type -> ... -> None -> plan,
+    #or role -> content class -> plan; walking it only hashes strings and classes
+    _plan_trie : Dict[Any, Any] = {}
+    max_plans : int = 256
+
+    @staticmethod
+    def message_shape(msg : Dict[str,Any]) -> Tuple[Any, Any]:
+        """Structural signature of msg: role and content entry types (or the class of the content)."""
+        content = msg.get('content')
+        if content.__class__ is list:
+            return (msg['role'], tuple([entry['type'] for entry in content]))
+        return (msg['role'], content.__class__)
+
+    @classmethod
+    def _generic_plan(cls, msg : Dict[str,Any], *args) -> List[Dict[str,Any]]:
+        return cls.convert_message(deepcopy(msg), *args)
+
+    @classmethod
+    def message_plan(cls, msg : Dict[str,Any]):
+        """Return the conversion function specialized for the shape of msg.
+
+        Plans are generated straight-line code, built on first sight of a shape
+        and cached per converter class. Like convert_message(), they return new
+        messages, but they copy only the parts of msg that are carried over, so
+        msg itself need not be copied first. Shapes that cannot be specialized,
+        or that arrive once the cache is full, go through convert_message() on
+        a copy of msg.
+        """
+        try:
+            node = cls._plan_trie.get(msg['role'])
+            content = msg.get('content')
+            if node is None:
+                plan = None
+            elif content.__class__ is list:
+                node = node.get(list)
+                for entry in content:
+                    if node is None:
+                        break
+                    node = node.get(entry['type'])
+                plan = None if node is None else node.get(None)
+            else:
+                plan = node.get(content.__class__)
+            if plan is not None:
+                return plan
+            shape = cls.message_shape(msg)
+        except (KeyError, TypeError):
+            return cls._generic_plan
+        if len(cls._plans) >= cls.max_plans:
+            return cls._generic_plan
+        plan = cls._plans[shape] = cls._build_plan(shape) or cls._generic_plan
+        role, content_type = shape
+        node = cls._plan_trie.setdefault(role, {})
+        if content_type.__class__ is tuple:
+            node = node.setdefault(list, {})
+            for entry_type in content_type:
+                node = node.setdefault(entry_type, {})
+            node[None] = plan
+        else:
+            node[content_type] = plan
+        return plan
 
 ApiFormat = Literal['openai', 'anthropic']
 
+_ANTHROPIC_IMAGE_MEDIA_TYPE = re.compile('^image/(.+$)')
+_OPENAI_IMAGE_DATA_URL = re.compile('^data:image/([^;]+);base64,(.+$)')
+
+def _copy(value : Any) -> Any:
+    #strings are by far the most common payload and need no copy
+    return value if value.__class__ is str else deepcopy(value)
+
+def _copy_text(entry : Dict[str,Any]) -> Dict[str,Any]:
+    return entry.copy() if len(entry) == 2 else deepcopy(entry)
+
+def _copy_message(msg : Dict[str,Any], content : Any = None) -> Dict[str,Any]:
+    """Copy of msg, with its 'content' replaced by content if given."""
+    if content is None:
+        return {key : _copy(value) for key, value in msg.items()}
+    return {key : (content if key == 'content' else _copy(value)) for key, value in msg.items()}
+
+def _openai_image_part(entry : Dict[str,Any], image_detail : str) -> Dict[str,Any]:
+    image_format = _ANTHROPIC_IMAGE_MEDIA_TYPE.search(entry['source']['media_type']).group(1)
+    return {
+        'type':'image_url',
+        'image_url': {
+            'url': f'data:image/{image_format};base64,{entry["source"]["data"]}',
+            'detail':image_detail,
+            }
+        }
+
+def _anthropic_image_part(entry : Dict[str,Any]) -> Dict[str,Any]:
+    image_format,image_data = _OPENAI_IMAGE_DATA_URL.search(entry['image_url']['url']).groups()
+    return {
+        'type':'image',
+        'source': {
+            'type':'base64',
+            'media_type':f'image/{image_format}',
+            'data':image_data,
+            },
+        }
+
+def _compile_plan(args : str, body : str):
+    """Compile ``def plan(args): return body``; body may refer to the message's content as c."""
+    namespace = {
+            '_copy':_copy,
+            '_copy_text':_copy_text,
+            '_copy_message':_copy_message,
+            '_deepcopy':deepcopy,
+            '_dumps':json.dumps,
+            '_loads':json.loads,
+            '_openai_image_part':_openai_image_part,
+            '_anthropic_image_part':_anthropic_image_part,
+            }
+    exec(f'def plan({args}):\n    c = msg.get(\'content\')\n    return {body}\n', namespace)
+    return namespace['plan']
+
 def translate(source : str,target : str) -> ToBase:
     """Translate between API formats.
     
@@ -35,6 +231,8 @@ def translate(source : str,target : str) -> ToBase:
 
 class FromAnthropic(FromBase):
     class ToOpenAi(ToBase):
+        target_format = 'openai'
+
         @staticmethod
         def convert_tool_schema(tool_schema_entry : Dict[str, Any], strict : bool = False):
             #anthropic
@@ -218,17 +416,116 @@ class FromAnthropic(FromBase):
                 case _:
                     output_messages.append(deepcopy(msg))
             return output_messages
+
+        @staticmethod
+        def convert_response(response : Dict[str,Any]) -> Dict[str,Any]:
+            """Convert an anthropic messages response into an openai chat completion."""
+            #anthropic:
+            # {'id':...,'type':'message','role':'assistant','model':...,
+            #  'content':[{'type':'text','text':...},{'type':'tool_use','id':...,'name':...,'input':...}],
+            #  'stop_reason':...,'usage':{'input_tokens':...,'output_tokens':...}}
+
+            #openai:
+            # {'id':...,'object':'chat.completion','model':...,
+            #  'choices':[{'index':0,'message':{'role':'assistant','content':...,'tool_calls':[...]},'finish_reason':...}],
+            #  'usage':{'prompt_tokens':...,'completion_tokens':...,'total_tokens':...}}
+            texts = []
+            tool_calls = []
+            for entry in response.get('content',[]):
+                match entry['type']:
+                    case 'text':
+                        texts.append(entry['text'])
+                    case 'tool_use':
+                        tool_calls.append({
+                            'id':entry['id'],
+                            'type':'function',
+                            'function':{
+                                'name':entry['name'],
+                                'arguments':json.dumps(entry['input']),
+                                }
+                            })
+            message = {'role':'assistant','content':''.join(texts) if texts else None}
+            if tool_calls:
+                message['tool_calls'] = tool_calls
+            finish_reasons = {'end_turn':'stop','stop_sequence':'stop','max_tokens':'length','tool_use':'tool_calls'}
+            result = {
+                    'id':response.get('id'),
+                    'object':'chat.completion',
+                    'model':response.get('model'),
+                    'choices':[{
+                        'index':0,
+                        'message':message,
+                        'finish_reason':finish_reasons.get(response.get('stop_reason'),response.get('stop_reason')),
+                        }],
+                    }
+            if 'usage' in response:
+                usage = response['usage']
+                result['usage'] = {
+                        'prompt_tokens':usage.get('input_tokens',0),
+                        'completion_tokens':usage.get('output_tokens',0),
+                        'total_tokens':usage.get('input_tokens',0) + usage.get('output_tokens',0),
+                        }
+            return result
+
+        _plans = {}
+        _plan_trie = {}
+
+        @staticmethod
+        def _build_plan(shape):
+            role, content_type = shape
+            args = "msg, image_detail='auto'"
+            if content_type.__class__ is not tuple or role not in ('assistant','user'):
+                return _compile_plan(args, '[_copy_message(msg)]')
+
+            outputs = []
+            if role == 'assistant':
+                for i, entry_type in enumerate(content_type):
+                    match entry_type:
+                        case 'tool_use':
+                            outputs.append(
+                                "{'role':'assistant','tool_calls':[{'id':c[%d]['id'],'type':'function',"
+                                "'function':{'name':c[%d]['name'],'arguments':_dumps(c[%d]['input'])}}]}" % (i, i, i))
+                        case 'text':
+                            outputs.append("{'role':'assistant','content':c[%d]['text']}" % i)
+                        case _:
+                            return None
+                return _compile_plan(args, '[' + ','.join(outputs) + ']')
+
+            #user: runs of text/image entries become one user message, each tool_result its own tool message
+            parts = None
+            for i, entry_type in enumerate(content_type):
+                match entry_type:
+                    case 'tool_result':
+                        parts = None
+                        outputs.append("{'role':'tool','tool_call_id':c[%d]['tool_use_id'],'content':_copy(c[%d]['content'])}" % (i, i))
+                    case 'text' | 'image':
+                        if parts is None:
+                            parts = []
+                            outputs.append(parts)
+                        if entry_type == 'text':
+                            parts.append("{'type':'text','text':c[%d]['text']}" % i)
+                        else:
+                            parts.append('_openai_image_part(c[%d], image_detail)' % i)
+                    case _:
+                        return None
+            outputs = [output if isinstance(output, str) else "{'role':'user','content':[" + ','.join(output) + ']}' for output in outputs]
+            return _compile_plan(args, '[' + ','.join(outputs) + ']')
+
         @classmethod
-        def convert(cls,api_params : Dict[str,Any]) -> Dict[str, Any]:
-            new_params = deepcopy(api_params)
+        def convert(cls,api_params : Dict[str,Any], media = None) -> Dict[str, Any]:
+            #message plans copy what they carry over, so messages are not deep-copied up front
+            new_params = {key : (value if key == 'messages' else deepcopy(value)) for key, value in api_params.items()}
             messages = []
             for msg in new_params['messages']:
-                messages.extend(cls.convert_message(msg))
+                messages.extend(cls.message_plan(msg)(msg))
             new_params['messages'] = messages
+            if media is not None:
+                media.replace_images(new_params, cls.target_format)
             return new_params
 
 class FromOpenAi(FromBase):
     class ToAnthropic(ToBase):
+        target_format = 'anthropic'
 
         @staticmethod
         def convert_tool_schema(tool_schema_entry : Dict[str,Any]) -> Dict[str,Any]:
@@ -396,10 +693,83 @@ class FromOpenAi(FromBase):
                     output_messages.append(cls.convert_vision(msg))
             return output_messages
 
+        @staticmethod
+        def convert_response(response : Dict[str,Any]) -> Dict[str,Any]:
+            """Convert an openai chat completion into an anthropic messages response."""
+            #openai:
+            # {'id':...,'object':'chat.completion','model':...,
+            #  'choices':[{'index':0,'message':{'role':'assistant','content':...,'tool_calls':[...]},'finish_reason':...}],
+            #  'usage':{'prompt_tokens':...,'completion_tokens':...,'total_tokens':...}}
+
+            #anthropic:
+            # {'id':...,'type':'message','role':'assistant','model':...,
+            #  'content':[{'type':'text','text':...},{'type':'tool_use','id':...,'name':...,'input':...}],
+            #  'stop_reason':...,'usage':{'input_tokens':...,'output_tokens':...}}
+            choice = response['choices'][0]
+            message = choice['message']
+            content = []
+            if message.get('content'):
+                content.append({'type':'text','text':message['content']})
+            for tool_call_entry in message.get('tool_calls') or []:
+                content.append({
+                    'type':'tool_use',
+                    'id':tool_call_entry['id'],
+                    'name':tool_call_entry['function']['name'],
+                    'input':json.loads(tool_call_entry['function']['arguments']),
+                    })
+            stop_reasons = {'stop':'end_turn','length':'max_tokens','tool_calls':'tool_use','function_call':'tool_use'}
+            result = {
+                    'id':response.get('id'),
+                    'type':'message',
+                    'role':'assistant',
+                    'model':response.get('model'),
+                    'content':content,
+                    'stop_reason':stop_reasons.get(choice.get('finish_reason'),choice.get('finish_reason')),
+                    }
+            if 'usage' in response:
+                usage = response['usage']
+                result['usage'] = {
+                        'input_tokens':usage.get('prompt_tokens',0),
+                        'output_tokens':usage.get('completion_tokens',0),
+                        }
+            return result
+
+        _plans = {}
+        _plan_trie = {}
+
+        @staticmethod
+        def _build_plan(shape):
+            role, content_type = shape
+            match role:
+                case 'assistant':
+                    #tool calls are not part of the shape, so the plan checks for them
+                    body = ("[{'role':'assistant','content':[{'type':'tool_use','id':t['id'],'name':t['function']['name'],"
+                            "'input':_loads(t['function']['arguments'])}]} for t in msg['tool_calls']] "
+                            "if 'tool_calls' in msg else [_copy_message(msg)]")
+                case 'tool':
+                    body = "[{'role':'user','content':[{'type':'tool_result','tool_use_id':msg['tool_call_id'],'content':_copy(c)}]}]"
+                case 'user' if content_type.__class__ is tuple:
+                    parts = []
+                    for i, entry_type in enumerate(content_type):
+                        match entry_type:
+                            case 'image_url':
+                                parts.append('_anthropic_image_part(c[%d])' % i)
+                            case 'text':
+                                parts.append('_copy_text(c[%d])' % i)
+                            case _:
+                                parts.append('_deepcopy(c[%d])' % i)
+                    body = '[_copy_message(msg, [' + ','.join(parts) + '])]'
+                case 'system' | 'user':
+                    body = '[_copy_message(msg)]'
+                case _:
+                    body = '[]'
+            return _compile_plan('msg', body)
+
 
         @classmethod
-        def convert(cls,api_params : Dict[str,Any]) -> Dict[str,Any]:
-            new_params = deepcopy(api_params)
+        def convert(cls,api_params : Dict[str,Any], media = None) -> Dict[str,Any]:
+            #message plans copy what they carry over, so messages are not deep-copied up front
+            new_params = {key : (value if key == 'messages' else deepcopy(value)) for key, value in api_params.items()}
             # misc params
             n = new_params.get('n')
             if n is not None and n != 1:
@@ -421,7 +791,7 @@ class FromOpenAi(FromBase):
                     else:
                         system_messages.append(msg['content'])
                 else:
-                    other_messages.extend(cls.convert_message(msg))
+                    other_messages.extend(cls.message_plan(msg)(msg))
             system_message = '\n'.join(system_messages).strip() if system_messages else ''
             new_params['messages'] = other_messages
             if len(system_message) > 0:
@@ -431,6 +801,9 @@ class FromOpenAi(FromBase):
             #convert tool schema
             if 'tools' in new_params:
                 new_params['tools'] = [cls.convert_tool_schema(tool_schema_entry) for tool_schema_entry in new_params['tools']]
+
+            if media is not None:
+                media.replace_images(new_params, cls.target_format)
             return new_params
 
 def format_tool_schema(api_format: ApiFormat, tools: List[Tuple[str,str,Dict[str,Any]]], strict: Optional[bool] = False) -> Dict[str,Any]:
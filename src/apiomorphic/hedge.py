@@ -0,0 +1,99 @@
+import asyncio
+from typing import Dict, Any, Callable, Awaitable
+
+from .core import ApiFormat, translate
+
+Sender = Callable[[Dict[str,Any]], Awaitable[Dict[str,Any]]]
+
+class HedgedDispatcher:
+    """Send one request to an openai-format and an anthropic-format backend, keep the first answer.
+
+    The request goes to the backend of its own format first (or to the only
+    configured one). If no response arrives within ``hedge_delay`` seconds, the
+    request is converted for the other backend and sent there too, unless it
+    cannot be converted (e.g. n=2 for anthropic), in which case the primary call
+    is left to finish on its own. The first
+    successful response wins, the other call is cancelled, and the winning
+    response is converted back to the caller's format.
+
+    Args:
+        senders: Async callables taking request params and returning a response, keyed by api format
+        hedge_delay: Seconds to wait on the primary backend before sending the hedged duplicate
+
+    Attributes:
+        stats: Counts of dispatched requests, hedges sent, and wins (overall and on hedged requests) per format
+    """
+
+    def __init__(self, senders : Dict[ApiFormat, Sender], hedge_delay : float = 0.05):
+        for api_format in senders:
+            if api_format not in ('openai', 'anthropic'):
+                raise ValueError(f'Invalid api_format {api_format}')
+        if not senders:
+            raise ValueError('At least one sender is required')
+        self.senders = senders
+        self.hedge_delay = hedge_delay
+        self.stats = {
+                'requests':0,
+                'hedged':0,
+                'wins':{api_format : 0 for api_format in senders},
+                'hedged_wins':{api_format : 0 for api_format in senders},
+                }
+
+    def win_rates(self) -> Dict[str,float]:
+        """Fraction of hedged requests won by each format."""
+        hedged = self.stats['hedged']
+        return {api_format : (wins / hedged if hedged else 0.0) for api_format, wins in self.stats['hedged_wins'].items()}
+
+    def _request_for(self, api_params, api_format, target):
+        if target == api_format:
+            return api_params
+        return translate(api_format, target).convert(api_params)
+
+    async def dispatch(self, api_params : Dict[str,Any], api_format : ApiFormat) -> Dict[str,Any]:
+        """Send api_params (in api_format) with hedging and return the response in api_format.
+
+        Raises:
+            Exception: The error of whichever call failed first, if every attempted backend failed
+        """
+        primary = api_format if api_format in self.senders else next(iter(self.senders))
+        secondary = next((target for target in self.senders if target != primary), None)
+        self.stats['requests'] += 1
+
+        tasks = {asyncio.ensure_future(self.senders[primary](self._request_for(api_params, api_format, primary))) : primary}
+        errors = []
+        try:
+            done, _ = await asyncio.wait(set(tasks), timeout=self.hedge_delay)
+            hedged = False
+            if secondary is not None and (not done or next(iter(done)).exception() is not None):
+                try:
+                    hedge_params = self._request_for(api_params, api_format, secondary)
+                except Exception:
+                    #not expressible in the other format; no hedge is sent
+                    hedge_params = None
+                if hedge_params is not None:
+                    hedged = True
+                    self.stats['hedged'] += 1
+                    tasks[asyncio.ensure_future(self.senders[secondary](hedge_params))] = secondary
+            pending = set(tasks)
+            while pending:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    if task.exception() is not None:
+                        errors.append(task.exception())
+                        continue
+                    winner = tasks[task]
+                    self.stats['wins'][winner] += 1
+                    if hedged:
+                        self.stats['hedged_wins'][winner] += 1
+                    response = task.result()
+                    if winner == api_format:
+                        return response
+                    return translate(winner, api_format).convert_response(response)
+            raise errors[0]
+        finally:
+            for task in tasks:
+                if not task.done():
+                    task.cancel()
+                elif not task.cancelled():
+                    #mark errors of the losing call as retrieved
+                    task.exception()
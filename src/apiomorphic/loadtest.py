@@ -0,0 +1,246 @@
+"""Replay captured requests through the translate() converters and report latency percentiles.
+
+Usage:
+    python -m apiomorphic.loadtest requests.jsonl --source openai --target anthropic \\
+        --mode asyncio --concurrency 16 --rate 500
+
+Prints a JSON report with throughput, p50/p95/p99 conversion latency, peak RSS
+and garbage collector pause time.
+"""
+import gc
+import os
+import sys
+import math
+import json
+import time
+import asyncio
+import argparse
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
+from typing import Dict, List, Optional, Any, Literal
+
+from .core import ApiFormat, translate
+
+try:
+    import resource
+except ImportError:
+    resource = None
+
+Mode = Literal['asyncio', 'thread', 'process']
+
+class _GcTimer:
+    """Accumulates garbage collector pause time through gc.callbacks."""
+
+    def __init__(self):
+        self.collections = 0
+        self.total = 0.0
+        self.max = 0.0
+        self._start = None
+
+    def __call__(self, phase, info):
+        if phase == 'start':
+            self._start = time.perf_counter()
+        elif self._start is not None:
+            pause = time.perf_counter() - self._start
+            self._start = None
+            self.collections += 1
+            self.total += pause
+            self.max = max(self.max, pause)
+
+    def install(self):
+        gc.callbacks.append(self)
+        return self
+
+    def remove(self):
+        gc.callbacks.remove(self)
+
+def _peak_rss_mb(who) -> Optional[float]:
+    if resource is None:
+        return None
+    maxrss = resource.getrusage(who).ru_maxrss
+    #kilobytes on linux, bytes on macos
+    return maxrss / 2**20 if sys.platform == 'darwin' else maxrss / 2**10
+
+def _percentile(ordered : List[float], q : float) -> float:
+    """Nearest-rank percentile of an ascending list."""
+    if not ordered:
+        return 0.0
+    rank = max(1, math.ceil(q / 100 * len(ordered)))
+    return ordered[min(rank, len(ordered)) - 1]
+
+def load_requests(path : str, request_field : Optional[str] = None) -> List[Dict[str,Any]]:
+    """Read requests from a JSONL capture, one per line, optionally nested under request_field."""
+    requests = []
+    with open(path, 'r', encoding='utf-8') as f:
+        for line in f:
+            if line.strip():
+                record = json.loads(line)
+                requests.append(record if request_field is None else record[request_field])
+    return requests
+
+def _convert_timed(converter, request, upstream_delay):
+    start = time.perf_counter()
+    converter.convert(request)
+    latency = time.perf_counter() - start
+    if upstream_delay:
+        time.sleep(upstream_delay)
+    return latency
+
+#per-process state for process mode
+_worker_converter = None
+_worker_gc = None
+
+def _init_worker(source, target):
+    global _worker_converter, _worker_gc
+    _worker_converter = translate(source, target)
+    _worker_gc = _GcTimer().install()
+
+def _process_task(request, upstream_delay):
+    latency = _convert_timed(_worker_converter, request, upstream_delay)
+    return latency, os.getpid(), (_worker_gc.collections, _worker_gc.total, _worker_gc.max)
+
+def _pace(start, i, rate):
+    if rate:
+        delay = start + i / rate - time.perf_counter()
+        if delay > 0:
+            time.sleep(delay)
+
+async def _run_asyncio(converter, requests, concurrency, rate, upstream_delay, latencies, errors):
+    semaphore = asyncio.Semaphore(concurrency)
+    start = time.perf_counter()
+
+    async def one(request):
+        try:
+            t0 = time.perf_counter()
+            await converter.aconvert(request)
+            latencies.append(time.perf_counter() - t0)
+            if upstream_delay:
+                await asyncio.sleep(upstream_delay)
+        except Exception:
+            errors.append(1)
+        finally:
+            semaphore.release()
+
+    tasks = []
+    for i, request in enumerate(requests):
+        if rate:
+            delay = start + i / rate - time.perf_counter()
+            if delay > 0:
+                await asyncio.sleep(delay)
+        await semaphore.acquire()
+        tasks.append(asyncio.ensure_future(one(request)))
+    await asyncio.gather(*tasks)
+
+def replay(requests : List[Dict[str,Any]], source : ApiFormat, target : ApiFormat, mode : Mode = 'asyncio',
+           concurrency : int = 8, rate : Optional[float] = None, upstream_delay : float = 0.0) -> Dict[str,Any]:
+    """Convert every request with translate(source, target) under load and report latency statistics.
+
+    Args:
+        requests: Requests in source format, replayed in order
+        source: Source API format ('openai' or 'anthropic')
+        target: Target API format ('openai' or 'anthropic')
+        mode: Run conversions on an asyncio loop (via aconvert), a thread pool or a process pool
+        concurrency: Maximum conversions in flight (pool size for thread and process modes)
+        rate: Target requests per second, or None to submit as fast as concurrency allows
+        upstream_delay: Seconds each request spends at a stub upstream after conversion
+
+    Returns:
+        Dict[str,Any]: JSON-serializable report
+
+    Raises:
+        ValueError: If mode is invalid
+    """
+    converter = translate(source, target)
+    latencies = []
+    errors = []
+    gc_timer = _GcTimer().install()
+    worker_gc = {}
+    start = time.perf_counter()
+    try:
+        match mode:
+            case 'asyncio':
+                asyncio.run(_run_asyncio(converter, requests, concurrency, rate, upstream_delay, latencies, errors))
+            case 'thread':
+                with ThreadPoolExecutor(max_workers=concurrency) as pool:
+                    futures = []
+                    for i, request in enumerate(requests):
+                        _pace(start, i, rate)
+                        futures.append(pool.submit(_convert_timed, converter, request, upstream_delay))
+                    for future in futures:
+                        try:
+                            latencies.append(future.result())
+                        except Exception:
+                            errors.append(1)
+            case 'process':
+                with ProcessPoolExecutor(max_workers=concurrency, initializer=_init_worker, initargs=(source, target)) as pool:
+                    futures = []
+                    for i, request in enumerate(requests):
+                        _pace(start, i, rate)
+                        futures.append(pool.submit(_process_task, request, upstream_delay))
+                    for future in futures:
+                        try:
+                            latency, pid, stats = future.result()
+                        except Exception:
+                            errors.append(1)
+                            continue
+                        latencies.append(latency)
+                        #worker counters are cumulative, keep the latest per process
+                        if stats[0] >= worker_gc.get(pid, (0,))[0]:
+                            worker_gc[pid] = stats
+            case _:
+                raise ValueError(f'Invalid mode {mode}')
+    finally:
+        gc_timer.remove()
+    duration = time.perf_counter() - start
+
+    collections = gc_timer.collections + sum(stats[0] for stats in worker_gc.values())
+    pause_total = gc_timer.total + sum(stats[1] for stats in worker_gc.values())
+    pause_max = max([gc_timer.max] + [stats[2] for stats in worker_gc.values()])
+    peak_rss = _peak_rss_mb(resource.RUSAGE_SELF) if resource is not None else None
+    if mode == 'process' and resource is not None:
+        peak_rss = max(peak_rss, _peak_rss_mb(resource.RUSAGE_CHILDREN))
+    ordered = sorted(latencies)
+    return {
+            'mode':mode,
+            'source':source,
+            'target':target,
+            'concurrency':concurrency,
+            'target_rate':rate,
+            'requests':len(requests),
+            'errors':len(errors),
+            'duration_s':duration,
+            'throughput_rps':len(latencies) / duration if duration > 0 else 0.0,
+            'latency_ms':{
+                'mean':1000 * sum(ordered) / len(ordered) if ordered else 0.0,
+                'p50':1000 * _percentile(ordered, 50),
+                'p95':1000 * _percentile(ordered, 95),
+                'p99':1000 * _percentile(ordered, 99),
+                'max':1000 * ordered[-1] if ordered else 0.0,
+                },
+            'peak_rss_mb':peak_rss,
+            'gc':{
+                'collections':collections,
+                'pause_ms_total':1000 * pause_total,
+                'pause_ms_max':1000 * pause_max,
+                },
+            }
+
+def main(argv : Optional[List[str]] = None) -> None:
+    parser = argparse.ArgumentParser(prog='python -m apiomorphic.loadtest', description=__doc__.splitlines()[0])
+    parser.add_argument('path', help='JSONL file of captured requests')
+    parser.add_argument('--source', required=True, choices=['openai', 'anthropic'])
+    parser.add_argument('--target', required=True, choices=['openai', 'anthropic'])
+    parser.add_argument('--mode', default='asyncio', choices=['asyncio', 'thread', 'process'])
+    parser.add_argument('--concurrency', type=int, default=8)
+    parser.add_argument('--rate', type=float, default=None, help='target requests per second')
+    parser.add_argument('--repeat', type=int, default=1, help='replay the capture this many times')
+    parser.add_argument('--upstream-delay', type=float, default=0.0, help='seconds spent at a stub upstream per request')
+    parser.add_argument('--request-field', default=None, help='field holding the request in each record')
+    args = parser.parse_args(argv)
+
+    requests = load_requests(args.path, args.request_field) * args.repeat
+    report = replay(requests, args.source, args.target, args.mode, args.concurrency, args.rate, args.upstream_delay)
+    json.dump(report, sys.stdout, indent=2)
+    sys.stdout.write('\n')
+
+if __name__ == '__main__':
+    main()
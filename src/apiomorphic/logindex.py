@@ -0,0 +1,207 @@
+import os
+import json
+import mmap
+import hashlib
+from bisect import bisect_left, bisect_right
+from typing import Dict, List, Optional, Any, Iterable, Iterator, Tuple
+
+from .core import ApiFormat, translate
+
+INDEX_VERSION = 2
+
+def _field(record : Dict[str,Any], path : str) -> Any:
+    for part in path.split('.'):
+        if not isinstance(record, dict):
+            return None
+        record = record.get(part)
+    return record
+
+def _key_value(value : Any) -> Any:
+    #objects and arrays are indexed as canonical json text so they are hashable
+    if isinstance(value, (dict, list)):
+        return json.dumps(value, sort_keys=True, separators=(',', ':'))
+    return value
+
+def _kind(value : Any) -> Optional[type]:
+    """Group of mutually comparable key values, or None for values no range query matches."""
+    match value:
+        case bool():
+            return bool
+        case int() | float() if value == value:
+            return float
+        case str():
+            return str
+        case _:
+            return None
+
+class LogIndex:
+    """Sidecar offset index for random access into a JSONL request log.
+
+    The index file (``<log_path>.idx`` by default) starts with a JSON header line
+    followed by one ``[offset, length, key values...]`` line per record. Records
+    are parsed once while indexing; afterwards the log is mmapped and only the
+    selected records are decoded and converted.
+
+    ``refresh()`` indexes records appended since the last call. A partial last
+    line is left for a later refresh. If the log was truncated or rewritten
+    (detected from its size and a hash of its first record), or the key fields
+    changed, the index is rebuilt from scratch.
+
+    Object and array key values are stored as canonical JSON text (sorted keys,
+    no whitespace); ``lookup()`` canonicalizes the queried value the same way.
+
+    Args:
+        log_path: JSONL log, one record per line
+        key_fields: Record fields to index; dotted paths reach into nested objects
+        index_path: Sidecar location, defaults to log_path + '.idx'
+        request_field: Field holding the request params inside each record, or None if records are requests
+    """
+
+    def __init__(self, log_path : str, key_fields : Iterable[str] = ('conversation_id', 'timestamp'),
+                 index_path : Optional[str] = None, request_field : Optional[str] = None):
+        self.log_path = log_path
+        self.key_fields = tuple(key_fields)
+        self.index_path = index_path if index_path is not None else log_path + '.idx'
+        self.request_field = request_field
+        self.entries : List[Tuple[Any,...]] = []
+        self._head = None
+        self._mm = None
+        self._sorted : Dict[str, Dict[type, List[Tuple[Any,int]]]] = {}
+        #field -> (kind, value) -> record numbers
+        self._groups : Dict[str, Dict[Tuple[Optional[type],Any],List[int]]] = {}
+        self._load()
+        self.refresh()
+
+    def __len__(self) -> int:
+        return len(self.entries)
+
+    @property
+    def indexed_bytes(self) -> int:
+        if not self.entries:
+            return 0
+        offset, length = self.entries[-1][:2]
+        return offset + length
+
+    def _header(self):
+        return {'version':INDEX_VERSION, 'key_fields':list(self.key_fields), 'head':self._head}
+
+    def _load(self):
+        try:
+            with open(self.index_path, 'r', encoding='utf-8') as f:
+                header = json.loads(f.readline() or 'null')
+                if header is None or header.get('version') != INDEX_VERSION or header.get('key_fields') != list(self.key_fields):
+                    return
+                self._head = header['head']
+                self.entries = [tuple(json.loads(line)) for line in f if line.endswith('\n')]
+        except FileNotFoundError:
+            pass
+
+    def _reset(self):
+        self.entries = []
+        self._head = None
+        self._sorted.clear()
+        self._groups.clear()
+
+    def _write(self, entries, rewrite):
+        with open(self.index_path, 'w' if rewrite else 'a', encoding='utf-8') as f:
+            if rewrite:
+                f.write(json.dumps(self._header()) + '\n')
+            for entry in entries:
+                f.write(json.dumps(entry) + '\n')
+
+    def refresh(self) -> int:
+        """Index records appended to the log since the last refresh. Returns the number added."""
+        size = os.path.getsize(self.log_path)
+        with open(self.log_path, 'rb') as f:
+            if self.entries:
+                f.seek(self.entries[0][0])
+                if size < self.indexed_bytes or hashlib.sha256(f.readline()).hexdigest() != self._head:
+                    self._reset()
+            rewrite = not self.entries
+            offset = self.indexed_bytes
+            f.seek(offset)
+            new_entries = []
+            for line in f:
+                if not line.endswith(b'\n'):
+                    break
+                if line.strip():
+                    record = json.loads(line)
+                    if self._head is None:
+                        self._head = hashlib.sha256(line).hexdigest()
+                    new_entries.append((offset, len(line)) + tuple(_key_value(_field(record, path)) for path in self.key_fields))
+                offset += len(line)
+        #trailing blank lines are absorbed into the last entry so they are not rescanned
+        if new_entries and offset > new_entries[-1][0] + new_entries[-1][1]:
+            last = new_entries[-1]
+            new_entries[-1] = (last[0], offset - last[0]) + last[2:]
+        if new_entries or rewrite:
+            self._write(new_entries, rewrite)
+        self.entries.extend(new_entries)
+        self._sorted.clear()
+        self._groups.clear()
+        if self._mm is not None:
+            self._mm.close()
+            self._mm = None
+        return len(new_entries)
+
+    def lookup(self, field : str, value : Any) -> List[int]:
+        """Record numbers whose field equals value, in log order.
+
+        Like between(), booleans never match numbers: 1 and 1.0 are equal, true is not.
+        """
+        groups = self._groups.get(field)
+        if groups is None:
+            column = 2 + self.key_fields.index(field)
+            groups = self._groups[field] = {}
+            for i, entry in enumerate(self.entries):
+                groups.setdefault((_kind(entry[column]), entry[column]), []).append(i)
+        value = _key_value(value)
+        return list(groups.get((_kind(value), value), []))
+
+    def between(self, field : str, start : Any, end : Any) -> List[int]:
+        """Record numbers with start <= field <= end, in log order.
+
+        Only values of the same kind as start and end are compared: numbers,
+        strings or booleans. Records missing the field, or holding a value of
+        another kind, are skipped.
+
+        Raises:
+            ValueError: If start and end are not both numbers, both strings or both booleans
+        """
+        kind = _kind(start)
+        if kind is None or kind is not _kind(end):
+            raise ValueError(f'Cannot range over {start!r} to {end!r}')
+        partitions = self._sorted.get(field)
+        if partitions is None:
+            column = 2 + self.key_fields.index(field)
+            partitions = self._sorted[field] = {}
+            for i, entry in enumerate(self.entries):
+                value_kind = _kind(entry[column])
+                if value_kind is not None:
+                    partitions.setdefault(value_kind, []).append((entry[column], i))
+            for ordered in partitions.values():
+                ordered.sort()
+        ordered = partitions.get(kind, [])
+        lo = bisect_left(ordered, (start,))
+        hi = bisect_right(ordered, (end, len(self.entries)))
+        return sorted(i for _, i in ordered[lo:hi])
+
+    def read(self, i : int) -> Dict[str,Any]:
+        """Decode record number i straight from the mmapped log."""
+        if self._mm is None:
+            with open(self.log_path, 'rb') as f:
+                self._mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        offset, length = self.entries[i][:2]
+        return json.loads(self._mm[offset:offset + length])
+
+    def convert(self, records : Iterable[int], source : ApiFormat, target : ApiFormat) -> Iterator[Dict[str,Any]]:
+        """Yield the selected records' requests converted from source to target format."""
+        converter = translate(source, target)
+        for i in records:
+            record = self.read(i)
+            yield converter.convert(record if self.request_field is None else record[self.request_field])
+
+    def close(self) -> None:
+        if self._mm is not None:
+            self._mm.close()
+            self._mm = None
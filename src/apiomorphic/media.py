@@ -0,0 +1,154 @@
+import os
+import time
+import base64
+import hashlib
+import threading
+from abc import ABC, abstractmethod
+from concurrent.futures import Future
+from typing import Dict, Optional, Any, Callable, Tuple
+
+from .core import ApiFormat, _OPENAI_IMAGE_DATA_URL
+
+class FileStore(ABC):
+    """Interface to a provider's file upload API."""
+
+    @abstractmethod
+    def upload(self, data : bytes, media_type : str) -> str:
+        """Upload data and return the provider's file id."""
+
+class LocalFileStore(FileStore):
+    """FileStore stand-in keeping uploads in memory, or in a directory if path is given."""
+
+    def __init__(self, path : Optional[str] = None):
+        self.path = path
+        self.files : Dict[str, Tuple[bytes, str]] = {}
+        self.uploads = 0
+        if path is not None:
+            os.makedirs(path, exist_ok=True)
+
+    def upload(self, data : bytes, media_type : str) -> str:
+        self.uploads += 1
+        file_id = f'file-{hashlib.sha256(data).hexdigest()[:24]}'
+        if self.path is None:
+            self.files[file_id] = (data, media_type)
+        else:
+            with open(os.path.join(self.path, file_id), 'wb') as f:
+                f.write(data)
+        return file_id
+
+    def download(self, file_id : str) -> bytes:
+        if self.path is None:
+            return self.files[file_id][0]
+        with open(os.path.join(self.path, file_id), 'rb') as f:
+            return f.read()
+
+class MediaCache:
+    """Upload each distinct image once and reference it by file id in converted requests.
+
+    Images are keyed by a hash of their base64 data. A file id is reused until
+    ``ttl`` seconds after its upload, after which the next request uploads the
+    image again; keep ttl below the provider's file retention. Expired ids are
+    dropped from the cache but never deleted from the store, since requests
+    already in flight may still use them.
+
+    Uploads run outside the cache lock, so cache hits are never stalled by a
+    slow upload; concurrent requests for an image being uploaded wait for that
+    one upload instead of starting their own.
+
+    Openai chat completions ``image_url`` parts cannot reference an uploaded
+    file, so openai images are left inline unless ``openai_file_parts`` is set
+    for an endpoint that accepts images as ``{'type':'file','file':{'file_id':...}}``
+    parts. Images with a ``detail`` other than 'auto' always stay inline, since
+    a file part has no way to carry it.
+
+    Args:
+        store: FileStore for the provider the converted requests are sent to
+        ttl: Seconds a file id is reused for
+        clock: Time source, for tests
+        openai_file_parts: Replace openai image_url data urls with file parts
+    """
+
+    def __init__(self, store : FileStore, ttl : float = 3600.0, clock : Callable[[], float] = time.monotonic,
+                 openai_file_parts : bool = False):
+        self.store = store
+        self.ttl = ttl
+        self.clock = clock
+        self.openai_file_parts = openai_file_parts
+        #content hash -> (file id, expiry)
+        self._file_ids : Dict[str, Tuple[str, float]] = {}
+        #content hash -> file id of the upload in progress
+        self._uploading : Dict[str, Future] = {}
+        self._lock = threading.Lock()
+
+    def __len__(self) -> int:
+        return len(self._file_ids)
+
+    def file_id(self, image_data : str, media_type : str) -> str:
+        """Return the file id for base64 image_data, uploading it if not cached."""
+        key = hashlib.sha256(image_data.encode('ascii')).hexdigest()
+        now = self.clock()
+        with self._lock:
+            cached = self._file_ids.get(key)
+            if cached is not None and cached[1] > now:
+                return cached[0]
+            upload = self._uploading.get(key)
+            if upload is None:
+                upload = self._uploading[key] = Future()
+                owner = True
+            else:
+                owner = False
+        if not owner:
+            return upload.result()
+        try:
+            file_id = self.store.upload(base64.b64decode(image_data), media_type)
+        except BaseException as e:
+            with self._lock:
+                del self._uploading[key]
+            upload.set_exception(e)
+            raise
+        with self._lock:
+            self._file_ids[key] = (file_id, now + self.ttl)
+            del self._uploading[key]
+        upload.set_result(file_id)
+        return file_id
+
+    def evict_expired(self) -> int:
+        """Drop expired file ids. Returns the number removed."""
+        now = self.clock()
+        with self._lock:
+            expired = [key for key, (_, expiry) in self._file_ids.items() if expiry <= now]
+            for key in expired:
+                del self._file_ids[key]
+        return len(expired)
+
+    def replace_images(self, api_params : Dict[str,Any], api_format : ApiFormat) -> Dict[str,Any]:
+        """Replace inline base64 images in api_params with file references, in place.
+
+        anthropic images become ``{'type':'image','source':{'type':'file','file_id':...}}``.
+        With openai_file_parts set, openai image_url data urls without a
+        non-default detail become ``{'type':'file','file':{'file_id':...}}``.
+        """
+        if api_format not in ('openai', 'anthropic'):
+            raise ValueError(f'Invalid api_format {api_format}')
+        self.evict_expired()
+        for msg in api_params['messages']:
+            content = msg.get('content')
+            if not isinstance(content, list):
+                continue
+            for i, entry in enumerate(content):
+                match api_format, entry.get('type'):
+                    case 'anthropic', 'image' if entry['source'].get('type') == 'base64':
+                        source = entry['source']
+                        content[i] = {
+                            'type':'image',
+                            'source':{'type':'file','file_id':self.file_id(source['data'], source['media_type'])},
+                            }
+                    case 'openai', 'image_url' if self.openai_file_parts and entry['image_url'].get('detail', 'auto') == 'auto':
+                        data_url = _OPENAI_IMAGE_DATA_URL.search(entry['image_url']['url'])
+                        if data_url is not None:
+                            image_format, image_data = data_url.groups()
+                            content[i] = {
+                                'type':'file',
+                                'file':{'file_id':self.file_id(image_data, f'image/{image_format}')},
+                                }
+        return api_params
@@ -0,0 +1,210 @@
+import os
+import re
+import json
+import mmap
+import hashlib
+import tempfile
+from collections import OrderedDict
+from typing import Dict, List, Optional, Any, Callable
+
+from .core import ToBase, ApiFormat, format_tool_schema
+
+#bump whenever the serialized form of a converted artifact changes
+STORE_VERSION = 1
+
+_NAME = re.compile(r'^[A-Za-z0-9._-]+$')
+
+class SharedArtifactStore:
+    """File-backed store of converted artifacts shared between worker processes.
+
+    Each artifact is serialized once as JSON into its own file named after the
+    store version, the artifact kind, an optional caller-supplied name and a
+    hash of the unconverted input, e.g.
+    ``v1-tools.FromOpenAi.ToAnthropic-<sha256>.json``. The name is only a label:
+    new content under the same name gets a new file. Only the first worker to
+    need an artifact converts it.
+
+    The serialized bytes are mmapped, so they live once in the page cache no
+    matter how many workers read them. Decoded artifacts do not: each process
+    that calls ``get_or_create()`` (or the helpers built on it) holds its own
+    Python copy, so that path saves conversion time, not memory. Callers that
+    forward JSON should use ``get_or_create_bytes()``, which returns a view of
+    the shared mapping and never decodes.
+
+    Within a process, hits are cheap. Hashes are remembered by input object
+    identity, so inputs must not be mutated after first use. The decoded
+    artifact is memoized and the same object is returned on every hit, so
+    treat it as read-only.
+
+    At most ``max_open`` artifacts are kept mmapped per process (each mmap
+    holds a file descriptor); the least recently used are closed.
+
+    Files are written to a temporary name and renamed into place, so readers
+    never observe a partial artifact. Changing ``version`` (or STORE_VERSION)
+    makes all existing entries unreachable; ``prune()`` deletes them.
+
+    Args:
+        path: Directory holding the artifacts, created if missing
+        version: Version tag mixed into every key
+        max_open: Maximum number of artifacts mmapped at once in this process
+        max_memo: Maximum number of hashes and decoded artifacts remembered in this process
+    """
+
+    def __init__(self, path : str, version : str = f'v{STORE_VERSION}', max_open : int = 32, max_memo : int = 128):
+        self.path = path
+        self.version = version
+        self.max_open = max_open
+        self.max_memo = max_memo
+        self._maps : OrderedDict[str, mmap.mmap] = OrderedDict()
+        #id(payload) -> (payload, digest); the payload is held so its id is not reused
+        self._digests : OrderedDict[int, Any] = OrderedDict()
+        self._decoded : OrderedDict[str, Any] = OrderedDict()
+        os.makedirs(path, exist_ok=True)
+
+    @staticmethod
+    def _remember(memo, key, value, limit):
+        memo[key] = value
+        if len(memo) > limit:
+            memo.popitem(last=False)
+
+    def key(self, kind : str, payload : Any, name : Optional[str] = None) -> str:
+        """Return the store key for the artifact of the given kind derived from payload.
+
+        Raises:
+            ValueError: If name contains characters other than letters, digits, '.', '_' and '-'
+        """
+        if name is not None and not _NAME.match(name):
+            raise ValueError(f'Invalid artifact name {name!r}')
+        cached = self._digests.get(id(payload))
+        if cached is not None and cached[0] is payload:
+            digest = cached[1]
+        else:
+            digest = hashlib.sha256(json.dumps(payload, sort_keys=True).encode('utf-8')).hexdigest()
+            self._remember(self._digests, id(payload), (payload, digest), self.max_memo)
+        if name is not None:
+            return f'{self.version}-{kind}-{name}-{digest}'
+        return f'{self.version}-{kind}-{digest}'
+
+    def _file(self, key : str) -> str:
+        return os.path.join(self.path, f'{key}.json')
+
+    def get_bytes(self, key : str) -> Optional[memoryview]:
+        """Return a read-only view of the serialized artifact, or None if absent."""
+        mm = self._maps.get(key)
+        if mm is None:
+            try:
+                with open(self._file(key), 'rb') as f:
+                    mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+            except FileNotFoundError:
+                return None
+            self._maps[key] = mm
+            while len(self._maps) > self.max_open:
+                self._close(self._maps.popitem(last=False)[1])
+        else:
+            self._maps.move_to_end(key)
+        return memoryview(mm)
+
+    @staticmethod
+    def _close(mm):
+        try:
+            mm.close()
+        except BufferError:
+            #a view is still held by a caller; the map is released along with it
+            pass
+
+    def put_bytes(self, key : str, data : bytes) -> None:
+        """Atomically publish serialized artifact data under key."""
+        fd, tmp = tempfile.mkstemp(dir=self.path, prefix='.tmp-')
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                f.write(data)
+            os.replace(tmp, self._file(key))
+        except BaseException:
+            os.unlink(tmp)
+            raise
+
+    def get_or_create_bytes(self, kind : str, payload : Any, factory : Callable[[Any], Any], name : Optional[str] = None) -> memoryview:
+        """Serialized artifact for payload, converting and publishing it on a miss.
+
+        The view is backed by the shared mapping, so no process keeps a decoded copy.
+        """
+        key = self.key(kind, payload, name)
+        data = self.get_bytes(key)
+        if data is None:
+            self.put_bytes(key, json.dumps(factory(payload)).encode('utf-8'))
+            data = self.get_bytes(key)
+        return data
+
+    def get_or_create(self, kind : str, payload : Any, factory : Callable[[Any], Any], name : Optional[str] = None) -> Any:
+        """Return the stored artifact for payload, converting and publishing it on a miss.
+
+        The decoded artifact is private to this process; see get_or_create_bytes().
+        """
+        key = self.key(kind, payload, name)
+        artifact = self._decoded.get(key)
+        if artifact is not None:
+            self._decoded.move_to_end(key)
+            return artifact
+        data = self.get_bytes(key)
+        if data is None:
+            artifact = factory(payload)
+            self.put_bytes(key, json.dumps(artifact).encode('utf-8'))
+        else:
+            with data:
+                artifact = json.loads(bytes(data))
+        self._remember(self._decoded, key, artifact, self.max_memo)
+        return artifact
+
+    def convert_tools(self, converter : ToBase, tools : List[Dict[str,Any]], name : Optional[str] = None) -> List[Dict[str,Any]]:
+        """Shared equivalent of ``[converter.convert_tool_schema(tool) for tool in tools]``."""
+        return self.get_or_create(
+                f'tools.{converter.__qualname__}',
+                tools,
+                lambda tools: [converter.convert_tool_schema(entry) for entry in tools],
+                name,
+                )
+
+    def format_tools(self, api_format : ApiFormat, tools : List[Any], strict : Optional[bool] = False, name : Optional[str] = None) -> List[Dict[str,Any]]:
+        """Shared equivalent of ``format_tool_schema(api_format, tools, strict)``."""
+        return self.get_or_create(
+                f'format.{api_format}.{strict}',
+                tools,
+                lambda tools: format_tool_schema(api_format, tools, strict),
+                name,
+                )
+
+    def system_prompt(self, messages : List[Dict[str,Any]], name : Optional[str] = None) -> str:
+        """Anthropic 'system' string for the system messages of an openai request.
+
+        Only prompts given a stable name are shared through the store; others
+        are built in-process, so per-request prompts do not accumulate files.
+        """
+        def build(system_messages):
+            texts = []
+            for msg in system_messages:
+                if isinstance(msg['content'],list):
+                    texts.extend([entry['text'] for entry in msg['content']])
+                else:
+                    texts.append(msg['content'])
+            return '\n'.join(texts).strip()
+        system_messages = [msg for msg in messages if msg['role'] == 'system']
+        if name is None:
+            return build(system_messages)
+        return self.get_or_create('system', system_messages, build, name)
+
+    def prune(self) -> int:
+        """Delete artifacts written under any other version. Returns the number removed."""
+        removed = 0
+        for name in os.listdir(self.path):
+            if name.endswith('.json') and not name.startswith(f'{self.version}-'):
+                os.unlink(os.path.join(self.path, name))
+                removed += 1
+        return removed
+
+    def close(self) -> None:
+        """Release the mmaps and memoized artifacts held by this process."""
+        for mm in self._maps.values():
+            self._close(mm)
+        self._maps.clear()
+        self._digests.clear()
+        self._decoded.clear()
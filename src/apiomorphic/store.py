@@ -0,0 +1,222 @@
+import os
+import sys
+import json
+import hashlib
+from collections import OrderedDict
+from typing import Dict, List, Optional, Any
+
+from .core import ApiFormat, translate
+
+#values of these keys come from a small vocabulary and are interned
+_INTERNED_VALUE_KEYS = frozenset(('role', 'type', 'media_type', 'detail'))
+
+class _Record(tuple):
+    """Compact stand-in for a dict: a flat tuple of interned keys alternating with values."""
+    __slots__ = ()
+
+class ConversationStore:
+    """Bounded in-memory store of conversations in a single compact form.
+
+    Each conversation is kept once, in the format it was written in, as nested
+    tuples with interned keys and roles instead of dicts. Strings of at least
+    ``blob_threshold`` characters (message text, base64 images) are kept in a
+    reference counted pool so a payload repeated across turns or conversations
+    is held once. ``get()`` rebuilds the request in either format, going
+    through the ``translate()`` converters when the formats differ.
+
+    When the estimated footprint exceeds ``max_bytes``, least recently used
+    conversations are evicted, or written to ``spill_dir`` and reloaded on the
+    next access if a spill directory is given. Without a spill directory the
+    ids of the last ``max_evicted`` evicted conversations are remembered, so
+    ``get()`` and ``append()`` raise KeyError for them rather than returning or
+    extending a truncated history; ``put()`` or ``delete()`` clears that. Older
+    ids are forgotten and treated as never stored.
+
+    Args:
+        api_format: Format of the requests written to the store ('openai' or 'anthropic')
+        max_bytes: Memory budget for stored conversations and pooled strings
+        spill_dir: Directory for evicted conversations, or None to drop them
+        blob_threshold: Minimum length of strings shared through the pool
+        max_evicted: Number of evicted conversation ids remembered without a spill directory
+    """
+
+    def __init__(self, api_format : ApiFormat = 'openai', max_bytes : int = 64 * 2**20,
+                 spill_dir : Optional[str] = None, blob_threshold : int = 256, max_evicted : int = 2**16):
+        if api_format not in ('openai', 'anthropic'):
+            raise ValueError(f'Invalid api_format {api_format}')
+        self.api_format = api_format
+        self.max_bytes = max_bytes
+        self.spill_dir = spill_dir
+        self.blob_threshold = blob_threshold
+        self.max_evicted = max_evicted
+        #conversation_id -> (params record, message records, nbytes), most recently used last
+        self._conversations : OrderedDict[str, Any] = OrderedDict()
+        #string -> [pooled string, refcount]
+        self._blobs : Dict[str, List[Any]] = {}
+        self._blob_bytes = 0
+        self._conversation_bytes = 0
+        #ids evicted without a spill directory, oldest first
+        self._evicted : OrderedDict[str, None] = OrderedDict()
+        if spill_dir is not None:
+            os.makedirs(spill_dir, exist_ok=True)
+
+    @property
+    def nbytes(self) -> int:
+        """Estimated memory held by the store."""
+        return self._conversation_bytes + self._blob_bytes
+
+    def __len__(self) -> int:
+        return len(self._conversations)
+
+    def __contains__(self, conversation_id : str) -> bool:
+        return conversation_id in self._conversations or (
+                self.spill_dir is not None and os.path.exists(self._spill_file(conversation_id)))
+
+    def put(self, conversation_id : str, api_params : Dict[str,Any]) -> None:
+        """Store (or replace) a full request in the store's api_format."""
+        self.delete(conversation_id)
+        params = {key : value for key, value in api_params.items() if key != 'messages'}
+        self._insert(conversation_id, self._encode(params), [self._encode(msg) for msg in api_params.get('messages',[])])
+
+    def append(self, conversation_id : str, *messages : Dict[str,Any]) -> None:
+        """Append messages in the store's api_format, creating the conversation if it was never stored.
+
+        Raises:
+            KeyError: If the conversation was evicted without a spill directory
+        """
+        if conversation_id in self._evicted:
+            raise KeyError(conversation_id)
+        if conversation_id in self:
+            params, records, nbytes = self._load(conversation_id)
+            records.extend(self._encode(msg) for msg in messages)
+            self._conversation_bytes -= nbytes
+            self._conversations[conversation_id] = (params, records, self._sizeof(records) + self._sizeof(params))
+            self._conversation_bytes += self._conversations[conversation_id][2]
+            self._evict()
+        else:
+            self._insert(conversation_id, self._encode({}), [self._encode(msg) for msg in messages])
+
+    def get(self, conversation_id : str, api_format : Optional[ApiFormat] = None) -> Dict[str,Any]:
+        """Return the request for conversation_id in api_format (default: the store's format).
+
+        Raises:
+            KeyError: If the conversation is unknown or was evicted without a spill directory
+        """
+        params, records, _ = self._load(conversation_id)
+        api_params = self._decode(params)
+        api_params['messages'] = [self._decode(record) for record in records]
+        if api_format is None or api_format == self.api_format:
+            return api_params
+        return translate(self.api_format, api_format).convert(api_params)
+
+    def delete(self, conversation_id : str) -> None:
+        """Remove a conversation from memory and from the spill directory."""
+        self._evicted.pop(conversation_id, None)
+        entry = self._conversations.pop(conversation_id, None)
+        if entry is not None:
+            self._release(entry)
+        if self.spill_dir is not None:
+            try:
+                os.unlink(self._spill_file(conversation_id))
+            except FileNotFoundError:
+                pass
+
+    def _insert(self, conversation_id, params, records):
+        nbytes = self._sizeof(records) + self._sizeof(params)
+        self._conversations[conversation_id] = (params, records, nbytes)
+        self._conversation_bytes += nbytes
+        self._evict()
+
+    def _load(self, conversation_id):
+        try:
+            self._conversations.move_to_end(conversation_id)
+            return self._conversations[conversation_id]
+        except KeyError:
+            pass
+        if self.spill_dir is None:
+            raise KeyError(conversation_id)
+        try:
+            with open(self._spill_file(conversation_id), 'r', encoding='utf-8') as f:
+                api_params = json.load(f)
+        except FileNotFoundError:
+            raise KeyError(conversation_id) from None
+        os.unlink(self._spill_file(conversation_id))
+        params = {key : value for key, value in api_params.items() if key != 'messages'}
+        self._insert(conversation_id, self._encode(params), [self._encode(msg) for msg in api_params['messages']])
+        return self._conversations[conversation_id]
+
+    def _evict(self):
+        #never evict the most recently used conversation
+        while self.nbytes > self.max_bytes and len(self._conversations) > 1:
+            conversation_id, entry = self._conversations.popitem(last=False)
+            if self.spill_dir is not None:
+                api_params = self._decode(entry[0])
+                api_params['messages'] = [self._decode(record) for record in entry[1]]
+                with open(self._spill_file(conversation_id), 'w', encoding='utf-8') as f:
+                    json.dump(api_params, f)
+            else:
+                self._evicted[conversation_id] = None
+                if len(self._evicted) > self.max_evicted:
+                    self._evicted.popitem(last=False)
+            self._release(entry)
+
+    def _release(self, entry):
+        params, records, nbytes = entry
+        self._conversation_bytes -= nbytes
+        self._release_blobs(params)
+        for record in records:
+            self._release_blobs(record)
+
+    def _release_blobs(self, obj):
+        if isinstance(obj, str):
+            if len(obj) >= self.blob_threshold:
+                slot = self._blobs[obj]
+                slot[1] -= 1
+                if slot[1] == 0:
+                    del self._blobs[obj]
+                    self._blob_bytes -= sys.getsizeof(obj)
+        elif isinstance(obj, _Record):
+            for value in obj[1::2]:
+                self._release_blobs(value)
+        elif isinstance(obj, tuple):
+            for value in obj:
+                self._release_blobs(value)
+
+    def _spill_file(self, conversation_id):
+        digest = hashlib.sha256(conversation_id.encode('utf-8')).hexdigest()
+        return os.path.join(self.spill_dir, f'{digest}.json')
+
+    def _encode(self, obj, key=None):
+        match obj:
+            case dict():
+                return _Record(item for k, v in obj.items() for item in (sys.intern(k), self._encode(v, k)))
+            case list():
+                return tuple(self._encode(v) for v in obj)
+            case str() if key in _INTERNED_VALUE_KEYS and len(obj) < self.blob_threshold:
+                return sys.intern(obj)
+            case str() if len(obj) >= self.blob_threshold:
+                slot = self._blobs.get(obj)
+                if slot is None:
+                    slot = self._blobs[obj] = [obj, 0]
+                    self._blob_bytes += sys.getsizeof(obj)
+                slot[1] += 1
+                return slot[0]
+            case _:
+                return obj
+
+    def _decode(self, obj):
+        if isinstance(obj, _Record):
+            return {key : self._decode(value) for key, value in zip(obj[::2], obj[1::2])}
+        if isinstance(obj, tuple):
+            return [self._decode(value) for value in obj]
+        return obj
+
+    def _sizeof(self, obj):
+        #pooled and interned strings are accounted for once, elsewhere
+        if isinstance(obj, _Record):
+            return sys.getsizeof(obj) + sum(self._sizeof(value) for value in obj[1::2])
+        if isinstance(obj, (tuple, list)):
+            return sys.getsizeof(obj) + sum(self._sizeof(value) for value in obj)
+        if isinstance(obj, str) and len(obj) >= self.blob_threshold:
+            return 0
+        return sys.getsizeof(obj)
@@ -0,0 +1,107 @@
+import os
+import pickle
+from multiprocessing import shared_memory, resource_tracker
+from typing import Dict, List, Any, Tuple
+
+#strings at least this long (base64 images, long prompts) travel out-of-band
+BUFFER_THRESHOLD = 1024
+
+class _Blob:
+    """Large string payload, pickled as an out-of-band PickleBuffer."""
+    __slots__ = ('data',)
+
+    def __init__(self, data : bytes):
+        self.data = data
+
+    def __reduce_ex__(self, protocol):
+        return (_blob_to_str, (pickle.PickleBuffer(self.data),))
+
+def _blob_to_str(buffer) -> str:
+    return str(buffer, 'utf-8', 'surrogatepass')
+
+def _extract(obj, threshold):
+    match obj:
+        case dict():
+            return {key : _extract(value, threshold) for key, value in obj.items()}
+        case list():
+            return [_extract(value, threshold) for value in obj]
+        case str() if len(obj) >= threshold:
+            #surrogatepass keeps lone surrogates, which json.loads can produce
+            return _Blob(obj.encode('utf-8', 'surrogatepass'))
+        case _:
+            return obj
+
+def dump_request(api_params : Dict[str,Any], threshold : int = BUFFER_THRESHOLD) -> Tuple[bytes, List[pickle.PickleBuffer]]:
+    """Serialize a request, keeping large strings out of the pickle stream.
+
+    Args:
+        api_params: Request in either API format, e.g. the output of convert()
+        threshold: Minimum string length moved to an out-of-band buffer
+
+    Returns:
+        Tuple[bytes, List[PickleBuffer]]: Pickle protocol 5 header and the
+        buffers it references, in order. Pass both to load_request().
+    """
+    buffers = []
+    header = pickle.dumps(_extract(api_params, threshold), protocol=5, buffer_callback=buffers.append)
+    return header, buffers
+
+def load_request(header : bytes, buffers : List[Any]) -> Dict[str,Any]:
+    """Rebuild a request from dump_request() output; buffers may be any bytes-like objects."""
+    return pickle.loads(header, buffers=buffers)
+
+def send_request(conn, api_params : Dict[str,Any], threshold : int = BUFFER_THRESHOLD) -> None:
+    """Send a request over a multiprocessing Connection, passing its large strings through shared memory.
+
+    The buffers are written once into a new shared memory segment and only the
+    pickle header and the segment name go through conn. The receiver decodes
+    the strings straight from the segment and unlinks it, so every sent request
+    must be received with recv_request(). On Windows, where a segment is
+    destroyed once its creator closes it, the buffers go through conn instead.
+    """
+    header, buffers = dump_request(api_params, threshold)
+    lengths = [buffer.raw().nbytes for buffer in buffers]
+    if not sum(lengths) or os.name == 'nt':
+        conn.send((None, lengths))
+        conn.send_bytes(header)
+        for buffer in buffers:
+            conn.send_bytes(buffer.raw())
+        return
+    segment = shared_memory.SharedMemory(create=True, size=sum(lengths))
+    #the receiver unlinks the segment, so this process must not clean it up at exit
+    resource_tracker.unregister(segment._name, 'shared_memory')
+    try:
+        offset = 0
+        for buffer, length in zip(buffers, lengths):
+            segment.buf[offset:offset + length] = buffer.raw()
+            offset += length
+        conn.send((segment.name, lengths))
+        conn.send_bytes(header)
+    except BaseException:
+        resource_tracker.register(segment._name, 'shared_memory')
+        segment.close()
+        segment.unlink()
+        raise
+    segment.close()
+
+def recv_request(conn) -> Dict[str,Any]:
+    """Receive a request sent with send_request() and release its shared memory segment."""
+    name, lengths = conn.recv()
+    header = conn.recv_bytes()
+    if name is None:
+        return load_request(header, [conn.recv_bytes() for _ in lengths])
+    segment = shared_memory.SharedMemory(name=name)
+    try:
+        views = []
+        offset = 0
+        for length in lengths:
+            views.append(segment.buf[offset:offset + length])
+            offset += length
+        try:
+            return load_request(header, views)
+        finally:
+            for view in views:
+                view.release()
+    finally:
+        segment.close()
+        segment.unlink()
@@ -1,9 +1,13 @@
 # test_apiomorphic.py
 import pytest
+import os
 import base64
 import json
+import threading
 from typing import Dict, Any
-from apiomorphic import translate, FromOpenAi, FromAnthropic, format_tool_schema
+from apiomorphic import translate, FromOpenAi, FromAnthropic, format_tool_schema, SharedArtifactStore, ConversationStore
+from apiomorphic import dump_request, load_request, send_request, recv_request
+from apiomorphic import HedgedDispatcher, LogIndex, FileStore, LocalFileStore, MediaCache
 
 # Fixtures
 @pytest.fixture
@@ -367,5 +371,544 @@ def test_format_tool_schema():
     except ValueError:
         pass
 
+# Shape-specialized conversion plans
+def test_message_plans_match_generic_conversion(sample_base64_image):
+    from copy import deepcopy
+    openai_messages = [
+        {"role": "user", "content": "Hello!"},
+        {"role": "user", "content": [
+            {"type": "text", "text": "What's in this image?"},
+            {"type": "image_url", "image_url": {"url": f"data:image/png;base64,{sample_base64_image}"}},
+        ]},
+        {"role": "assistant", "tool_calls": [
+            {"id": "call_1", "type": "function", "function": {"name": "f", "arguments": '{"a": 1}'}},
+            {"id": "call_2", "type": "function", "function": {"name": "g", "arguments": '{}'}},
+        ]},
+        {"role": "tool", "tool_call_id": "call_1", "content": "ok"},
+        {"role": "assistant", "content": "Done."},
+    ]
+    to_anthropic = FromOpenAi.ToAnthropic
+    for msg in openai_messages:
+        expected = to_anthropic.convert_message(deepcopy(msg))
+        assert to_anthropic.message_plan(msg)(deepcopy(msg)) == expected
+
+    to_openai = FromAnthropic.ToOpenAi
+    for msg in to_anthropic.convert({"messages": openai_messages})["messages"] + [
+        {"role": "user", "content": [
+            {"type": "text", "text": "a"},
+            {"type": "tool_result", "tool_use_id": "call_1", "content": "ok"},
+            {"type": "image", "source": {"type": "base64", "media_type": "image/jpeg", "data": sample_base64_image}},
+        ]},
+        {"role": "assistant", "content": [{"type": "text", "text": "b"}, {"type": "tool_use", "id": "c", "name": "f", "input": {}}]},
+    ]:
+        expected = to_openai.convert_message(deepcopy(msg))
+        assert to_openai.message_plan(msg)(deepcopy(msg)) == expected
+
+def test_message_plan_cache():
+    converter = FromAnthropic.ToOpenAi
+    msg = {"role": "user", "content": [{"type": "text", "text": "hi"}]}
+    shape = converter.message_shape(msg)
+    assert shape == ("user", ("text",))
+    plan = converter.message_plan(msg)
+    assert converter._plans[shape] is plan
+    assert converter.message_plan({"role": "user", "content": [{"type": "text", "text": "other"}]}) is plan
+
+    # shapes that cannot be specialized fall back to the generic path
+    unknown = {"role": "user", "content": [{"type": "document"}]}
+    assert converter.message_plan(unknown) == converter._generic_plan
+    assert FromOpenAi.ToAnthropic._plans is not converter._plans
+
+def test_message_plan_cache_full(monkeypatch):
+    converter = FromOpenAi.ToAnthropic
+    monkeypatch.setattr(converter, "_plans", {})
+    monkeypatch.setattr(converter, "_plan_trie", {})
+    monkeypatch.setattr(converter, "max_plans", 1)
+    converter.message_plan({"role": "user", "content": "a"})
+    built = []
+    monkeypatch.setattr(converter, "_build_plan", staticmethod(lambda shape: built.append(shape)))
+    assert converter.message_plan({"role": "tool", "tool_call_id": "c", "content": "r"}) == converter._generic_plan
+    assert built == [] and len(converter._plans) == 1
+
+def test_message_plans_do_not_alias_input():
+    openai_msg = {"role": "user", "content": [{"type": "text", "text": "hi"}], "name": "bob"}
+    tool_msg = {"role": "tool", "tool_call_id": "c", "content": [{"type": "text", "text": "r"}]}
+    for msg in (openai_msg, tool_msg):
+        before = json.loads(json.dumps(msg))
+        result = FromOpenAi.ToAnthropic.message_plan(msg)(msg)
+        result[0]["content"][0]["extra"] = 1
+        assert msg == before
+    anthropic_msg = {"role": "user", "content": [{"type": "tool_result", "tool_use_id": "c", "content": [{"type": "text", "text": "r"}]}]}
+    result = FromAnthropic.ToOpenAi.message_plan(anthropic_msg)(anthropic_msg)
+    result[0]["content"].append(None)
+    assert len(anthropic_msg["content"][0]["content"]) == 1
+
+# Shared artifact store
+def test_shared_artifact_store(tmp_path):
+    tools = [{"type": "function", "function": {"name": "get_weather", "parameters": {"type": "object", "properties": {}}}}]
+    converter = FromOpenAi.ToAnthropic
+    calls = []
+    def convert_tool_schema(entry):
+        calls.append(entry)
+        return converter.convert_tool_schema(entry)
+
+    worker_a = SharedArtifactStore(str(tmp_path))
+    worker_b = SharedArtifactStore(str(tmp_path))
+    expected = [converter.convert_tool_schema(tools[0])]
+    assert worker_a.convert_tools(converter, tools) == expected
+    assert worker_b.convert_tools(converter, tools) == expected
+    key = worker_b.key(f"tools.{converter.__qualname__}", tools)
+    assert json.loads(bytes(worker_b.get_bytes(key))) == expected
+
+    assert worker_b.get_or_create("tools", tools, lambda t: [convert_tool_schema(e) for e in t]) == expected
+    assert worker_b.get_or_create("tools", tools, lambda t: [convert_tool_schema(e) for e in t]) == expected
+    assert len(calls) == 1
+
+    # hits in the same process neither hash nor decode again
+    assert worker_a.convert_tools(converter, tools) is worker_a.convert_tools(converter, tools)
+    assert worker_a.convert_tools(converter, tools, name="catalog-1") == expected
+
+    # only named system prompts are persisted
+    messages = [{"role": "system", "content": "Be brief."}, {"role": "user", "content": "Hi"}]
+    expected_system = translate("openai", "anthropic").convert({"messages": messages})["system"]
+    files = len(list(tmp_path.iterdir()))
+    assert worker_a.system_prompt(messages) == expected_system
+    assert len(list(tmp_path.iterdir())) == files
+    assert worker_a.system_prompt(messages, name="brief") == expected_system
+    assert worker_a.format_tools("anthropic", [("f", "d", {})]) == format_tool_schema("anthropic", [("f", "d", {})])
+
+    # a name is only a label: new content under the same name is never served the old artifact
+    old = [{"role": "system", "content": "old prompt"}]
+    new = [{"role": "system", "content": "NEW prompt"}]
+    assert worker_a.system_prompt(old, name="main") == "old prompt"
+    restarted = SharedArtifactStore(str(tmp_path))
+    assert restarted.system_prompt(new, name="main") == "NEW prompt"
+    assert restarted.system_prompt(json.loads(json.dumps(old)), name="main") == "old prompt"
+    renamed_tools = [{**tools[0], "function": {**tools[0]["function"], "name": "get_time"}}]
+    assert restarted.convert_tools(converter, renamed_tools, name="catalog-1")[0]["name"] == "get_time"
+
+    # the bytes path returns the shared mapping without decoding
+    view = restarted.get_or_create_bytes("tools", tools, lambda t: calls.append(t))
+    assert json.loads(bytes(view)) == expected and len(calls) == 1
+    view.release()
+    restarted.close()
+    with pytest.raises(ValueError):
+        worker_a.key("tools", tools, name="../escape")
+
+    # a new version invalidates everything written under the old one
+    upgraded = SharedArtifactStore(str(tmp_path), version="v2")
+    assert upgraded.get_bytes(upgraded.key(f"tools.{converter.__qualname__}", tools)) is None
+    worker_a.close()
+    worker_b.close()
+    assert upgraded.prune() == 8
+    assert list(tmp_path.iterdir()) == []
+
+def test_shared_artifact_store_bounds_open_maps(tmp_path):
+    store = SharedArtifactStore(str(tmp_path), max_open=2, max_memo=2)
+    for i in range(10):
+        assert store.get_or_create("n", i, lambda i: [i], name=f"item-{i}") == [i]
+    for i in range(10):
+        assert json.loads(bytes(store.get_bytes(store.key("n", i, name=f"item-{i}")))) == [i]
+    assert len(store._maps) == 2
+    assert len(store._decoded) == 2
+    store.close()
+
+# Conversation store
+def test_conversation_store_views(sample_base64_image, basic_messages):
+    store = ConversationStore('openai', blob_threshold=8)
+    store.put("a", basic_messages["openai"])
+    assert store.get("a") == basic_messages["openai"]
+    assert store.get("a", "anthropic") == basic_messages["anthropic"]
+
+    image = {"role": "user", "content": [{"type": "image_url", "image_url": {"url": f"data:image/png;base64,{sample_base64_image}"}}]}
+    store.append("a", image)
+    store.append("b", json.loads(json.dumps(image)))
+    assert store.get("a")["messages"][-1] == image
+    assert store.get("b", "anthropic")["messages"][0]["content"][0]["type"] == "image"
+    # the same image url is pooled once for both conversations
+    url_a = store.get("a")["messages"][-1]["content"][0]["image_url"]["url"]
+    url_b = store.get("b")["messages"][0]["content"][0]["image_url"]["url"]
+    assert url_a is url_b
+
+    store.delete("a")
+    store.delete("b")
+    assert len(store) == 0
+    assert store.nbytes == 0
+    with pytest.raises(KeyError):
+        store.get("a")
+
+def test_conversation_store_eviction(tmp_path, basic_messages):
+    size = ConversationStore()
+    size.put("x", basic_messages["openai"])
+    budget = size.nbytes * 2
+
+    store = ConversationStore(max_bytes=budget)
+    for conversation_id in "abc":
+        store.put(conversation_id, basic_messages["openai"])
+    assert "a" not in store
+    assert store.nbytes <= budget
+    store.get("b")
+    store.put("d", basic_messages["openai"])
+    assert "b" in store and "c" not in store
+
+    # evicted history is never silently replaced by a fresh conversation
+    tiny = ConversationStore(max_bytes=1)
+    tiny.append("a", {"role": "user", "content": "first"})
+    tiny.append("b", {"role": "user", "content": "other"})
+    with pytest.raises(KeyError):
+        tiny.append("a", {"role": "user", "content": "second"})
+    with pytest.raises(KeyError):
+        tiny.get("a")
+    tiny.put("a", {"messages": [{"role": "user", "content": "restarted"}]})
+    assert tiny.get("a")["messages"] == [{"role": "user", "content": "restarted"}]
+
+    # only the most recently evicted ids are remembered
+    bounded = ConversationStore(max_bytes=1, max_evicted=3)
+    for i in range(100):
+        bounded.put(str(i), {"messages": [{"role": "user", "content": "hi"}]})
+    assert len(bounded) == 1 and len(bounded._evicted) == 3
+    with pytest.raises(KeyError):
+        bounded.append("98", {"role": "user", "content": "again"})
+    bounded.append("0", {"role": "user", "content": "new"})
+
+    spilling = ConversationStore(max_bytes=budget, spill_dir=str(tmp_path))
+    for conversation_id in "abc":
+        spilling.put(conversation_id, basic_messages["openai"])
+    assert len(spilling) == 2 and "a" in spilling
+    assert spilling.get("a", "anthropic") == basic_messages["anthropic"]
+    assert len(spilling) == 2 and len(list(tmp_path.iterdir())) == 1
+
+# Out-of-band request serialization
+def _recv_request_child(conn):
+    conn.send(recv_request(conn))
+
+def test_request_serialization_round_trip(sample_base64_image, basic_messages):
+    import multiprocessing
+    image_data = sample_base64_image * 100
+    anthropic_params = {
+        "model": "m",
+        "max_tokens": 100,
+        "system": "Be brief.",
+        "messages": [
+            {"role": "user", "content": [
+                {"type": "image", "source": {"type": "base64", "media_type": "image/png", "data": image_data}},
+                {"type": "text", "text": "What's in this image?"},
+            ]},
+            {"role": "assistant", "content": [{"type": "tool_use", "id": "c", "name": "f", "input": {"x": 1.5, "y": None}}]},
+        ],
+    }
+    openai_params = translate("anthropic", "openai").convert(anthropic_params)
+    for params in (anthropic_params, openai_params):
+        header, buffers = dump_request(params)
+        assert len(buffers) == 1
+        assert image_data not in header.decode("latin-1")
+        assert load_request(header, [memoryview(buffer) for buffer in buffers]) == params
+
+    # lone surrogates survive json.loads and must survive the round trip too
+    surrogate = json.loads('"\\ud800' + "x" * 2000 + '"')
+    header, buffers = dump_request({"messages": [{"role": "user", "content": surrogate}]})
+    assert load_request(header, buffers)["messages"][0]["content"] == surrogate
+
+    # payloads travel through a shared memory segment the receiver unlinks
+    shm_dir = "/dev/shm"
+    segments = set(os.listdir(shm_dir)) if os.path.isdir(shm_dir) else set()
+    receiver, sender = multiprocessing.Pipe(duplex=False)
+    send_request(sender, openai_params)
+    send_request(sender, basic_messages["openai"])
+    assert recv_request(receiver) == openai_params
+    assert recv_request(receiver) == basic_messages["openai"]
+    receiver.close()
+    sender.close()
+    if os.path.isdir(shm_dir):
+        assert set(os.listdir(shm_dir)) == segments
+
+    context = multiprocessing.get_context("spawn")
+    parent, child = context.Pipe()
+    process = context.Process(target=_recv_request_child, args=(child,))
+    process.start()
+    send_request(parent, openai_params)
+    assert parent.recv() == openai_params
+    process.join()
+    assert process.exitcode == 0
+
+# Response conversion
+def test_response_conversion():
+    anthropic_response = {
+        "id": "msg_1",
+        "type": "message",
+        "role": "assistant",
+        "model": "m",
+        "content": [
+            {"type": "text", "text": "Checking."},
+            {"type": "tool_use", "id": "call_1", "name": "get_weather", "input": {"location": "London"}},
+        ],
+        "stop_reason": "tool_use",
+        "usage": {"input_tokens": 10, "output_tokens": 5},
+    }
+    openai_response = FromAnthropic.ToOpenAi.convert_response(anthropic_response)
+    assert openai_response["choices"][0] == {
+        "index": 0,
+        "message": {
+            "role": "assistant",
+            "content": "Checking.",
+            "tool_calls": [{"id": "call_1", "type": "function", "function": {"name": "get_weather", "arguments": '{"location": "London"}'}}],
+        },
+        "finish_reason": "tool_calls",
+    }
+    assert openai_response["usage"] == {"prompt_tokens": 10, "completion_tokens": 5, "total_tokens": 15}
+    assert FromOpenAi.ToAnthropic.convert_response(openai_response) == anthropic_response
+
+# Hedged dispatch
+def test_hedged_dispatch(basic_messages):
+    import asyncio
+    calls = []
+    def backend(api_format, delay, fail=False):
+        async def send(api_params):
+            calls.append((api_format, api_params))
+            await asyncio.sleep(delay)
+            if fail:
+                raise RuntimeError(api_format)
+            if api_format == "openai":
+                return {"id": "1", "model": "m", "choices": [{"index": 0, "message": {"role": "assistant", "content": "hi"}, "finish_reason": "stop"}]}
+            return {"id": "1", "model": "m", "type": "message", "role": "assistant", "content": [{"type": "text", "text": "hi"}], "stop_reason": "end_turn"}
+        return send
+
+    # fast primary: no hedge is sent
+    dispatcher = HedgedDispatcher({"openai": backend("openai", 0), "anthropic": backend("anthropic", 0)}, hedge_delay=1)
+    response = asyncio.run(dispatcher.dispatch(basic_messages["openai"], "openai"))
+    assert response["choices"][0]["message"]["content"] == "hi"
+    assert [api_format for api_format, _ in calls] == ["openai"]
+    assert dispatcher.stats["hedged"] == 0
+
+    # slow primary: the hedged anthropic call wins and is normalized to openai
+    calls.clear()
+    dispatcher = HedgedDispatcher({"openai": backend("openai", 10), "anthropic": backend("anthropic", 0)}, hedge_delay=0.01)
+    response = asyncio.run(dispatcher.dispatch(basic_messages["openai"], "openai"))
+    assert response["choices"][0] == {"index": 0, "message": {"role": "assistant", "content": "hi"}, "finish_reason": "stop"}
+    assert calls[1] == ("anthropic", basic_messages["anthropic"])
+    assert dispatcher.win_rates() == {"openai": 0.0, "anthropic": 1.0}
+
+    # a request the other format cannot express is not hedged and the primary still answers
+    calls.clear()
+    dispatcher = HedgedDispatcher({"openai": backend("openai", 0.05), "anthropic": backend("anthropic", 0)}, hedge_delay=0.01)
+    response = asyncio.run(dispatcher.dispatch({**basic_messages["openai"], "n": 2}, "openai"))
+    assert response["choices"][0]["message"]["content"] == "hi"
+    assert [api_format for api_format, _ in calls] == ["openai"]
+    assert dispatcher.stats["hedged"] == 0 and dispatcher.stats["wins"]["openai"] == 1
+
+    # failing primary hedges immediately; all backends failing raises
+    dispatcher = HedgedDispatcher({"anthropic": backend("anthropic", 0, fail=True), "openai": backend("openai", 0)}, hedge_delay=10)
+    assert asyncio.run(dispatcher.dispatch(basic_messages["anthropic"], "anthropic"))["content"] == [{"type": "text", "text": "hi"}]
+    dispatcher = HedgedDispatcher({"anthropic": backend("anthropic", 0, fail=True)})
+    with pytest.raises(RuntimeError):
+        asyncio.run(dispatcher.dispatch(basic_messages["anthropic"], "anthropic"))
+
+# Log index
+def test_log_index(tmp_path, basic_messages):
+    log = tmp_path / "requests.jsonl"
+    def record(conversation_id, timestamp):
+        return json.dumps({"conversation_id": conversation_id, "timestamp": timestamp, "request": basic_messages["openai"]}) + "\n"
+    log.write_text(record("a", 1) + "\n" + record("b", 2) + record("a", 3))
+
+    index = LogIndex(str(log), request_field="request")
+    assert len(index) == 3
+    assert index.lookup("conversation_id", "a") == [0, 2]
+    assert index.between("timestamp", 2, 3) == [1, 2]
+    assert list(index.convert(index.lookup("conversation_id", "b"), "openai", "anthropic")) == [basic_messages["anthropic"]]
+    index.close()
+
+    # appends are picked up incrementally, partial lines wait for the next refresh
+    partial = record("c", 4)
+    with open(log, "a") as f:
+        f.write(partial[:10])
+    reopened = LogIndex(str(log), request_field="request")
+    assert len(reopened) == 3
+    with open(log, "a") as f:
+        f.write(partial[10:])
+    assert reopened.refresh() == 1
+    assert reopened.read(3)["conversation_id"] == "c"
+    assert LogIndex(str(log)).entries == reopened.entries
+
+    # object keys are looked up by value; range queries skip values of another kind
+    mixed = tmp_path / "mixed.jsonl"
+    keys = [{"b": 1, "a": [2]}, 5, "x", True, None, 2.5, {"a": [2], "b": 1}, float("nan")]
+    mixed.write_text("".join(json.dumps({"key": key}) + "\n" for key in keys))
+    index = LogIndex(str(mixed), key_fields=("key",))
+    assert index.lookup("key", {"a": [2], "b": 1}) == [0, 6]
+    assert index.lookup("key", [2]) == []
+    assert index.between("key", 0, 10) == [1, 5]
+    assert index.between("key", "a", "z") == [2]
+    assert index.between("key", True, True) == [3]
+    with pytest.raises(ValueError):
+        index.between("key", 0, "z")
+    assert LogIndex(str(mixed), key_fields=("key",)).lookup("key", {"b": 1, "a": [2]}) == [0, 6]
+
+    # booleans and numbers are kept apart by lookup as well
+    flags = tmp_path / "flags.jsonl"
+    flags.write_text('{"k": 1}\n{"k": true}\n{"k": 1.0}\n{"k": null}\n')
+    index = LogIndex(str(flags), key_fields=("k",))
+    assert index.lookup("k", 1) == [0, 2]
+    assert index.lookup("k", True) == [1]
+    assert index.lookup("k", None) == [3]
+    reopened.close()
+
+    # a rewritten log is reindexed from scratch
+    log.write_text(record("z", 9))
+    rewritten = LogIndex(str(log))
+    assert rewritten.lookup("conversation_id", "z") == [0]
+    assert len(rewritten) == 1
+
+# Asyncio conversion
+def test_aconvert(monkeypatch, sample_base64_image, basic_messages):
+    import asyncio
+    from apiomorphic import ToBase
+    converter = translate("openai", "anthropic")
+    params = dict(basic_messages["openai"])
+    params["messages"] = params["messages"] + [{"role": "user", "content": [
+        {"type": "image_url", "image_url": {"url": f"data:image/png;base64,{sample_base64_image * 1000}"}},
+    ]}]
+    monkeypatch.setattr(ToBase, "inline_threshold", 10000)
+    monkeypatch.setattr(ToBase, "async_stats", {"inline": 0, "offloaded": 0, "inline_seconds": 0.0, "max_inline_seconds": 0.0})
+
+    async def collect():
+        return [msg async for msg in converter.aiter_messages(params)]
+
+    assert asyncio.run(converter.aconvert(basic_messages["openai"])) == basic_messages["anthropic"]
+    assert asyncio.run(converter.aconvert(params)) == converter.convert(params)
+    assert ToBase.async_stats["inline"] == 1 and ToBase.async_stats["offloaded"] == 1
+    assert asyncio.run(collect()) == [out for msg in params["messages"] for out in converter.convert_message(json.loads(json.dumps(msg)))]
+    assert ToBase.async_stats["offloaded"] == 2
+    assert ToBase.async_stats["max_inline_seconds"] <= ToBase.async_stats["inline_seconds"]
+
+    async def cancelled():
+        task = asyncio.ensure_future(converter.aconvert(params))
+        await asyncio.sleep(0)
+        task.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await task
+    asyncio.run(cancelled())
+
+# Upload-once media references
+def test_media_cache(sample_base64_image):
+    now = [0.0]
+    store = LocalFileStore()
+    media = MediaCache(store, ttl=60, clock=lambda: now[0])
+    image = {"type": "image_url", "image_url": {"url": f"data:image/png;base64,{sample_base64_image}"}}
+    openai_params = {"messages": [
+        {"role": "user", "content": [image, {"type": "text", "text": "first"}]},
+        {"role": "user", "content": [image]},
+    ]}
+
+    anthropic_params = translate("openai", "anthropic").convert(openai_params, media=media)
+    file_id = anthropic_params["messages"][0]["content"][0]["source"]["file_id"]
+    assert anthropic_params["messages"][0]["content"][0] == {"type": "image", "source": {"type": "file", "file_id": file_id}}
+    assert anthropic_params["messages"][1]["content"][0]["source"]["file_id"] == file_id
+    assert store.uploads == 1
+    assert store.download(file_id) == b"fake_image_data"
+
+    # openai images stay inline unless file parts are enabled, and a detail setting keeps them inline
+    anthropic_image = {"role": "user", "content": [{"type": "image", "source": {"type": "base64", "media_type": "image/png", "data": sample_base64_image}}]}
+    inline = translate("anthropic", "openai").convert({"messages": [anthropic_image]}, media=media)
+    assert inline["messages"][0]["content"][0]["type"] == "image_url"
+    file_media = MediaCache(store, ttl=60, clock=lambda: now[0], openai_file_parts=True)
+    openai_result = translate("anthropic", "openai").convert({"messages": [anthropic_image]}, media=file_media)
+    assert openai_result["messages"][0]["content"] == [{"type": "file", "file": {"file_id": file_id}}]
+    detailed = {"type": "image_url", "image_url": {"url": image["image_url"]["url"], "detail": "high"}}
+    assert file_media.replace_images({"messages": [{"role": "user", "content": [detailed]}]}, "openai")["messages"][0]["content"] == [detailed]
+    assert store.uploads == 2
+    # remote urls are left alone
+    remote = {"type": "image_url", "image_url": {"url": "https://example.com/a.png"}}
+    assert media.replace_images({"messages": [{"role": "user", "content": [remote]}]}, "openai")["messages"][0]["content"] == [remote]
+
+    now[0] = 61
+    translate("openai", "anthropic").convert(openai_params, media=media)
+    assert store.uploads == 3
+    assert len(media) == 1
+
+    with pytest.raises(TypeError):
+        FileStore()
+
+class _GatedFileStore(LocalFileStore):
+    """Uploads signal when they start and block until released, recording the uploading thread."""
+    def __init__(self):
+        super().__init__()
+        self.started = threading.Event()
+        self.release = threading.Event()
+        self.release.set()
+        self.threads = []
+        self.released_in_time = True
+
+    def upload(self, data, media_type):
+        self.threads.append(threading.get_ident())
+        self.started.set()
+        self.released_in_time = self.release.wait(timeout=10) and self.released_in_time
+        return super().upload(data, media_type)
+
+def test_media_cache_uploads_off_lock(sample_base64_image):
+    store = _GatedFileStore()
+    media = MediaCache(store)
+    other = base64.b64encode(b"other_image").decode("ascii")
+    cached = media.file_id(other, "image/png")
+    store.release.clear()
+    store.started.clear()
+    results = []
+    threads = [threading.Thread(target=lambda: results.append(media.file_id(sample_base64_image, "image/png"))) for _ in range(2)]
+    threads[0].start()
+    assert store.started.wait(timeout=10)
+    threads[1].start()
+    # a hit on another image returns while the upload is still blocked
+    assert media.file_id(other, "image/png") == cached
+    store.release.set()
+    for thread in threads:
+        thread.join()
+    assert store.released_in_time
+    # concurrent misses share one upload
+    assert len(set(results)) == 1 and store.uploads == 2
+
+def test_aconvert_media(sample_base64_image, monkeypatch):
+    import asyncio
+    from concurrent.futures import ProcessPoolExecutor
+    store = _GatedFileStore()
+    media = MediaCache(store)
+    openai_params = {"messages": [{"role": "user", "content": [{"type": "image_url", "image_url": {"url": f"data:image/png;base64,{sample_base64_image}"}}]}]}
+
+    async def run(executor=None):
+        return await FromOpenAi.ToAnthropic.aconvert(openai_params, executor=executor, media=media), threading.get_ident()
+
+    # the upload of a small request runs off the event loop thread
+    result, loop_thread = asyncio.run(run())
+    assert result["messages"][0]["content"][0]["source"]["type"] == "file"
+    assert store.threads and loop_thread not in store.threads
+
+    # the cache stays in this process when converting in another one
+    monkeypatch.setattr(FromOpenAi.ToAnthropic, "inline_threshold", 0)
+    with ProcessPoolExecutor(max_workers=1) as pool:
+        result, _ = asyncio.run(run(pool))
+    assert result == {"messages": [{"role": "user", "content": [
+        {"type": "image", "source": {"type": "file", "file_id": media.file_id(sample_base64_image, "image/png")}}]}]}
+    assert openai_params["messages"][0]["content"][0]["type"] == "image_url"
+
+# Load harness
+@pytest.mark.parametrize("mode", ["asyncio", "thread", "process"])
+def test_loadtest_replay(tmp_path, basic_messages, mode):
+    from apiomorphic import loadtest
+    capture = tmp_path / "capture.jsonl"
+    capture.write_text("".join(json.dumps({"request": basic_messages["openai"]}) + "\n" for _ in range(20)))
+    requests = loadtest.load_requests(str(capture), request_field="request")
+    report = loadtest.replay(requests, "openai", "anthropic", mode=mode, concurrency=2, upstream_delay=0.001)
+    assert report["requests"] == 20 and report["errors"] == 0
+    assert report["throughput_rps"] > 0
+    latency = report["latency_ms"]
+    assert 0 <= latency["p50"] <= latency["p95"] <= latency["p99"] <= latency["max"]
+    assert set(report["gc"]) == {"collections", "pause_ms_total", "pause_ms_max"}
+    json.dumps(report)
+
+def test_loadtest_percentile():
+    from apiomorphic.loadtest import _percentile
+    values = [float(v) for v in range(1, 101)]
+    assert _percentile(values, 50) == 50
+    assert _percentile(values, 99) == 99
+    assert _percentile([1.0, 2.0], 50) == 1.0
+    assert _percentile([], 95) == 0.0
+
 if __name__ == "__main__":
     pytest.main([__file__])